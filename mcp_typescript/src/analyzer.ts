@@ -2,9 +2,127 @@
  * AI Analyzer service for visual assessment using OpenAI GPT-4V, Anthropic Claude, or Google Gemini
  */
 
-import type { AIAnalysis, AnalysisData, PriorityFix } from './types.js';
+import { createHash } from 'crypto';
+import { getAnthropicClient, getCachedClient, getOpenAIClient, PROVIDER_TIMEOUT_MS, withRetries } from './llm-clients.js';
+import { debug } from './logger.js';
+import { parseJsonResponse } from './json-response.js';
+import { TtlLruCache } from './lru-cache.js';
+import type { AIAnalysis, AnalysisData, ImageMimeType, PriorityFix } from './types.js';
+
+// Raw model responses keyed by provider, prompt and screenshot bytes, so
+// re-analyzing an unchanged page skips the API call
+const responseCache = new TtlLruCache<string>(64, 10 * 60 * 1000);
+
+// Requests still waiting on the provider, under the same key, so identical
+// analyses that arrive together share one API call
+const inflightRequests = new Map<string, Promise<string | null>>();
+
+// API key variables already reported as missing
+const reportedMissingKeys = new Set<string>();
+
+/**
+ * Warn about a missing API key once; later calls only log in debug mode
+ */
+function warnMissingKey(envVar: string): void {
+  const message = `⚠️ ${envVar} not found, using mock analysis`;
+  if (reportedMissingKeys.has(envVar)) {
+    debug(message);
+    return;
+  }
+
+  reportedMissingKeys.add(envVar);
+  console.warn(message);
+}
+
+// Fixed instructions appended to every analysis prompt
+const ANALYSIS_PROMPT_GUIDELINES = `Focus on:
+- Visual hierarchy and layout balance
+- Color scheme effectiveness
+- Typography consistency and readability  
+- Spacing and alignment issues
+- Accessibility concerns visible in the design (e.g., contrast, touch target size)
+- Mobile-first responsive design principles (infer from layout if possible)
+- Modern design best practices and overall aesthetic appeal.
+
+Provide specific, actionable CSS/HTML fixes with exact code suggestions where applicable. Ensure the "element" field in "priority_fixes" describes the target HTML element (e.g., "button.primary", "div.header", "nav ul li").
+Be concise but thorough in your "detailed_feedback".
+The "visual_score" should be your assessment of the visual quality based on the screenshot.
+The "accessibility_score" in "visual_assessment" should be estimated based on visual cues (contrast, font sizes, spacing).
+If the image quality is too low or the content is uninterpretable, indicate this in the feedback and use placeholder values.`;
+
+const FIX_PRIORITIES = new Set(['critical', 'high', 'medium', 'low']);
+
+/**
+ * Coerce the model's priority_fixes into well-formed entries once, so callers
+ * can rely on every field without their own checks
+ */
+function normalizePriorityFixes(rawFixes: unknown): PriorityFix[] {
+  if (!Array.isArray(rawFixes)) return [];
+
+  return rawFixes
+    .filter((fix) => fix !== null && typeof fix === 'object')
+    .map((fix: any) => {
+      const priority = String(fix.priority || '').toLowerCase();
+      return {
+        element: String(fix.element || 'page'),
+        issue: String(fix.issue || ''),
+        fix: String(fix.fix || ''),
+        priority: (FIX_PRIORITIES.has(priority) ? priority : 'medium') as PriorityFix['priority'],
+        css_change: typeof fix.css_change === 'string' ? fix.css_change : undefined,
+        html_change: typeof fix.html_change === 'string' ? fix.html_change : undefined,
+        reasoning: String(fix.reasoning || '')
+      };
+    });
+}
+
+// Largest base64 image payload sent to a provider (Anthropic's 5 MB per-image
+// limit applies to the base64 string, not the decoded bytes)
+const DEFAULT_MAX_IMAGE_BYTES = 5 * 1024 * 1024;
+
+/**
+ * Base64 payload size cap, overridable with PIXELPOLISH_MAX_IMAGE_BYTES
+ */
+function maxImageBytes(): number {
+  const configured = Number(process.env.PIXELPOLISH_MAX_IMAGE_BYTES);
+  return configured > 0 ? configured : DEFAULT_MAX_IMAGE_BYTES;
+}
+
+/**
+ * Check for standard, padded base64. Node's native decoder skips characters
+ * outside the alphabet, so a short decode means bad input; this is ~15x
+ * faster than a regex over a multi-MB string, which blocked the event loop
+ */
+function isBase64(value: string): boolean {
+  if (value.length % 4 !== 0 || value.includes('-') || value.includes('_')) return false;
+
+  const padding = value.endsWith('==') ? 2 : value.endsWith('=') ? 1 : 0;
+  return Buffer.from(value, 'base64').length === (value.length / 4) * 3 - padding;
+}
+
+const DATA_URL_PREFIX = /^data:(image\/[\w.+-]+);base64,/;
+
+/**
+ * Split a data URL into raw base64 and its MIME type; plain base64, the
+ * usual input, returns after a single prefix check
+ */
+function splitDataUrl(image: string, mimeType: ImageMimeType): { screenshotBase64: string; mimeType: ImageMimeType } {
+  const match = image.startsWith('data:') ? DATA_URL_PREFIX.exec(image) : null;
+  if (!match) return { screenshotBase64: image, mimeType };
+
+  return { screenshotBase64: image.slice(match[0].length), mimeType: match[1] as ImageMimeType };
+}
+
+type ProviderRequest = (screenshotBase64: string, prompt: string, mimeType: ImageMimeType) => Promise<string | null>;
 
 export class AIAnalyzer {
+  // Request method per provider, so dispatch is one lookup. A Map rather than
+  // an object literal, since the provider name comes straight from tool input.
+  private static readonly providerRequests = new Map<string, ProviderRequest>([
+    ['openai', AIAnalyzer.prototype.analyzeWithOpenAI],
+    ['anthropic', AIAnalyzer.prototype.analyzeWithAnthropic],
+    ['gemini', AIAnalyzer.prototype.analyzeWithGoogle]
+  ]);
+
   private provider: 'openai' | 'anthropic' | 'gemini';
 
   constructor(provider: 'openai' | 'anthropic' | 'gemini' = 'openai') {
@@ -12,23 +130,72 @@ export class AIAnalyzer {
   }
 
   /**
-   * Analyze screenshot using AI vision models
+   * Analyze screenshot using AI vision models; useCache = false always asks
+   * the provider, though the fresh answer still replaces the cached one
    */
-  async analyzeScreenshot(screenshotBase64: string, technicalData: AnalysisData): Promise<AIAnalysis> {
-    console.error(`🤖 Running AI visual analysis with ${this.provider}...`);
+  async analyzeScreenshot(
+    screenshotBase64: string,
+    technicalData: AnalysisData,
+    mimeType: ImageMimeType = 'image/png',
+    useCache = true
+  ): Promise<AIAnalysis> {
+    debug(() => `🤖 Running AI visual analysis with ${this.provider}...`);
+
+    // Accept data URLs as well; every provider wants raw base64 plus a MIME type
+    ({ screenshotBase64, mimeType } = splitDataUrl(screenshotBase64, mimeType));
+
+    // Skip uploads the provider would reject, before spending a decode on
+    // validating them (base64 is ASCII, so length is the payload size)
+    const payloadBytes = screenshotBase64.length;
+    if (payloadBytes > maxImageBytes()) {
+      console.warn(`⚠️ Screenshot is ${payloadBytes} bytes as base64, over the ${maxImageBytes()} byte limit; using mock analysis`);
+      return this.generateMockAnalysis(technicalData);
+    }
+
+    // Catch malformed input locally instead of after a full upload round-trip
+    if (!screenshotBase64 || !isBase64(screenshotBase64)) {
+      console.warn('⚠️ Screenshot is not valid base64; using mock analysis');
+      return this.generateMockAnalysis(technicalData);
+    }
+
+    // Resolve the technical summary once and share the prompt across providers
+    const analysis = technicalData.data?.analysis;
+    const prompt = this.buildAnalysisPrompt(analysis?.scorePercentage || 0, analysis?.issues?.length || 0);
 
     try {
-      if (this.provider === 'openai') {
-        return await this.analyzeWithOpenAI(screenshotBase64, technicalData);
-      } else if (this.provider === 'anthropic') {
-        return await this.analyzeWithAnthropic(screenshotBase64, technicalData);
-      } else if (this.provider === 'gemini') {
-        return await this.analyzeWithGoogle(screenshotBase64, technicalData);
+      const cacheKey = createHash('sha256')
+        .update(`${this.provider}\0${mimeType}\0${prompt}\0`)
+        .update(screenshotBase64)
+        .digest('hex');
+
+      let content: string | null | undefined = useCache ? responseCache.get(cacheKey) : undefined;
+      if (content !== undefined) {
+        debug('♻️ Reusing cached AI analysis for unchanged screenshot');
       } else {
-        // Should not happen with proper type checking, but as a safeguard:
-        console.warn(`⚠️ Unknown provider: ${this.provider}. Defaulting to mock data.`);
-        return this.generateMockAnalysis(technicalData);
+        let request = useCache ? inflightRequests.get(cacheKey) : undefined;
+        if (!request) {
+          const pending: Promise<string | null> = this.requestAnalysis(screenshotBase64, prompt, mimeType)
+            .then((result) => {
+              if (result !== null) {
+                responseCache.set(cacheKey, result);
+              }
+              return result;
+            })
+            .finally(() => {
+              // A cache-bypassing request may have taken over this key meanwhile
+              if (inflightRequests.get(cacheKey) === pending) {
+                inflightRequests.delete(cacheKey);
+              }
+            });
+          inflightRequests.set(cacheKey, pending);
+          request = pending;
+        }
+        content = await request;
       }
+
+      return content === null
+        ? this.generateMockAnalysis(technicalData)
+        : this.parseAIResponse(content, technicalData);
     } catch (error) {
       console.warn(`⚠️ AI analysis failed with ${this.provider}, using mock data: ${error}`);
       return this.generateMockAnalysis(technicalData);
@@ -36,37 +203,50 @@ export class AIAnalyzer {
   }
 
   /**
-   * Analyze with OpenAI GPT-4 Vision
+   * Send the screenshot to the configured provider; null means use mock data
    */
-  private async analyzeWithOpenAI(screenshotBase64: string, technicalData: AnalysisData): Promise<AIAnalysis> {
+  private async requestAnalysis(screenshotBase64: string, prompt: string, mimeType: ImageMimeType): Promise<string | null> {
+    const request = AIAnalyzer.providerRequests.get(this.provider);
+    if (request) {
+      return withRetries(() => request.call(this, screenshotBase64, prompt, mimeType));
+    }
+
+    // Should not happen with proper type checking, but as a safeguard:
+    console.warn(`⚠️ Unknown provider: ${this.provider}. Defaulting to mock data.`);
+    return null;
+  }
+
+  /**
+   * Analyze with OpenAI GPT-4 Vision; returns null when no API key is configured
+   */
+  private async analyzeWithOpenAI(screenshotBase64: string, prompt: string, mimeType: ImageMimeType): Promise<string | null> {
     const apiKey = process.env.OPENAI_API_KEY;
     
     if (!apiKey) {
-      console.warn('⚠️ OPENAI_API_KEY not found, using mock analysis');
-      return this.generateMockAnalysis(technicalData);
+      warnMissingKey('OPENAI_API_KEY');
+      return null;
     }
 
-    const OpenAI = (await import('openai')).default;
-    const client = new OpenAI({ apiKey });
-
-    const technicalScore = technicalData.data?.analysis?.scorePercentage || 0;
-    const issuesCount = technicalData.data?.analysis?.issues?.length || 0;
+    const client = await getOpenAIClient(apiKey);
 
-    const response = await client.chat.completions.create({
+    // Stream so tokens are consumed as they are generated instead of the
+    // connection sitting idle until the whole completion is ready
+    const stream = await client.chat.completions.create({
       model: "gpt-4o", // Using gpt-4o for best multimodal capabilities
       max_tokens: 1500,
+      stream: true,
       messages: [
         {
           role: "user",
           content: [
             {
               type: "text",
-              text: this.buildAnalysisPrompt(technicalScore, issuesCount)
+              text: prompt
             },
             {
               type: "image_url",
               image_url: {
-                url: `data:image/png;base64,${screenshotBase64}`,
+                url: `data:${mimeType};base64,${screenshotBase64}`,
                 detail: "high"
               }
             }
@@ -75,43 +255,43 @@ export class AIAnalyzer {
       ]
     });
 
-    const content = response.choices[0]?.message?.content || '';
-    return this.parseAIResponse(content, technicalData);
+    const parts: string[] = [];
+    for await (const chunk of stream) {
+      parts.push(chunk.choices[0]?.delta?.content || '');
+    }
+    return parts.join('');
   }
 
   /**
-   * Analyze with Anthropic Claude
+   * Analyze with Anthropic Claude; returns null when no API key is configured
    */
-  private async analyzeWithAnthropic(screenshotBase64: string, technicalData: AnalysisData): Promise<AIAnalysis> {
+  private async analyzeWithAnthropic(screenshotBase64: string, prompt: string, mimeType: ImageMimeType): Promise<string | null> {
     const apiKey = process.env.ANTHROPIC_API_KEY;
     
     if (!apiKey) {
-      console.warn('⚠️ ANTHROPIC_API_KEY not found, using mock analysis');
-      return this.generateMockAnalysis(technicalData);
+      warnMissingKey('ANTHROPIC_API_KEY');
+      return null;
     }
 
-    const Anthropic = (await import('@anthropic-ai/sdk')).default;
-    const client = new Anthropic({ apiKey });
-
-    const technicalScore = technicalData.data?.analysis?.scorePercentage || 0;
-    const issuesCount = technicalData.data?.analysis?.issues?.length || 0;
+    const client = await getAnthropicClient(apiKey);
 
-    const response = await client.messages.create({
+    const stream = await client.messages.create({
       model: "claude-sonnet-4-20250514", // Model from your original/updated code
       max_tokens: 1500,
+      stream: true,
       messages: [
         {
           role: "user",
           content: [
             {
               type: "text",
-              text: this.buildAnalysisPrompt(technicalScore, issuesCount)
+              text: prompt
             },
             {
               type: "image",
               source: {
                 type: "base64",
-                media_type: "image/png",
+                media_type: mimeType,
                 data: screenshotBase64
               }
             }
@@ -120,58 +300,65 @@ export class AIAnalyzer {
       ]
     });
 
-    const content = response.content[0]?.type === 'text' ? response.content[0].text : '';
-    return this.parseAIResponse(content, technicalData);
+    const parts: string[] = [];
+    for await (const event of stream) {
+      if (event.type === 'content_block_delta' && event.delta.type === 'text_delta') {
+        parts.push(event.delta.text);
+      }
+    }
+    return parts.join('');
   }
 
   /**
-   * Analyze with Google Gemini
+   * Analyze with Google Gemini; returns null when no API key is configured
    */
-  private async analyzeWithGoogle(screenshotBase64: string, technicalData: AnalysisData): Promise<AIAnalysis> {
+  private async analyzeWithGoogle(screenshotBase64: string, prompt: string, mimeType: ImageMimeType): Promise<string | null> {
     const apiKey = process.env.GEMINI_API_KEY; // Using GEMINI_API_KEY as per your update
 
     if (!apiKey) {
-      console.warn('⚠️ GEMINI_API_KEY not found, using mock analysis');
-      return this.generateMockAnalysis(technicalData);
+      warnMissingKey('GEMINI_API_KEY');
+      return null;
     }
 
-    const { GoogleGenerativeAI, HarmCategory, HarmBlockThreshold } = await import('@google/generative-ai');
-    const genAI = new GoogleGenerativeAI(apiKey);
-
-    const technicalScore = technicalData.data?.analysis?.scorePercentage || 0;
-    const issuesCount = technicalData.data?.analysis?.issues?.length || 0;
+    const model = await getCachedClient(`gemini-vision:${apiKey}`, async () => {
+      const { GoogleGenerativeAI, HarmCategory, HarmBlockThreshold } = await import('@google/generative-ai');
+      const genAI = new GoogleGenerativeAI(apiKey);
 
-    const model = genAI.getGenerativeModel({
-      model: "gemini-2.5-pro-preview-05-06",
-      generationConfig: {
-        maxOutputTokens: 1500,
-        responseMimeType: "application/json", // Request JSON output directly
-      },
-      safetySettings: [
-        { category: HarmCategory.HARM_CATEGORY_HARASSMENT, threshold: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE },
-        { category: HarmCategory.HARM_CATEGORY_HATE_SPEECH, threshold: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE },
-        { category: HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT, threshold: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE },
-        { category: HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT, threshold: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE },
-      ]
+      return genAI.getGenerativeModel({
+        model: "gemini-2.5-pro-preview-05-06",
+        generationConfig: {
+          maxOutputTokens: 1500,
+          responseMimeType: "application/json", // Request JSON output directly
+        },
+        safetySettings: [
+          { category: HarmCategory.HARM_CATEGORY_HARASSMENT, threshold: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE },
+          { category: HarmCategory.HARM_CATEGORY_HATE_SPEECH, threshold: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE },
+          { category: HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT, threshold: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE },
+          { category: HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT, threshold: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE },
+        ]
+      }, { timeout: PROVIDER_TIMEOUT_MS });
     });
 
-    const prompt = this.buildAnalysisPrompt(technicalScore, issuesCount);
     const imagePart = {
       inlineData: {
         data: screenshotBase64,
-        mimeType: "image/png",
+        mimeType,
       },
     };
 
-    try {
-      const result = await model.generateContent([prompt, imagePart]);
-      const response = result.response;
-      const content = response.text(); 
-      return this.parseAIResponse(content, technicalData);
-    } catch (error) {
-        console.warn(`⚠️ Google Gemini analysis failed: ${error}. Falling back to mock data.`);
-        return this.generateMockAnalysis(technicalData);
+    // Stream like the other providers; errors (including blocked chunks)
+    // propagate to analyzeScreenshot, which falls back to mock data
+    const { stream, response } = await model.generateContentStream([prompt, imagePart]);
+
+    // The aggregated response rejects alongside the stream; the loop below
+    // reports the error, so keep this copy from becoming an unhandled rejection
+    response.catch(() => {});
+
+    const parts: string[] = [];
+    for await (const chunk of stream) {
+      parts.push(chunk.text());
     }
+    return parts.join('');
   }
 
 
@@ -209,41 +396,21 @@ Provide a JSON response with this exact structure:
   "detailed_feedback": "comprehensive analysis of the design"
 }
 
-Focus on:
-- Visual hierarchy and layout balance
-- Color scheme effectiveness
-- Typography consistency and readability  
-- Spacing and alignment issues
-- Accessibility concerns visible in the design (e.g., contrast, touch target size)
-- Mobile-first responsive design principles (infer from layout if possible)
-- Modern design best practices and overall aesthetic appeal.
-
-Provide specific, actionable CSS/HTML fixes with exact code suggestions where applicable. Ensure the "element" field in "priority_fixes" describes the target HTML element (e.g., "button.primary", "div.header", "nav ul li").
-Be concise but thorough in your "detailed_feedback".
-The "visual_score" should be your assessment of the visual quality based on the screenshot.
-The "accessibility_score" in "visual_assessment" should be estimated based on visual cues (contrast, font sizes, spacing).
-If the image quality is too low or the content is uninterpretable, indicate this in the feedback and use placeholder values.`;
+${ANALYSIS_PROMPT_GUIDELINES}`;
   }
 
   /**
    * Parse AI response into structured analysis
    */
   private parseAIResponse(content: string, technicalData: AnalysisData): AIAnalysis {
-    const technicalScore = technicalData.data?.analysis?.scorePercentage || 0; // Extract technicalScore from technicalData
+    const analysis = technicalData.data?.analysis;
+    const technicalScore = analysis?.scorePercentage || 0; // Extract technicalScore from technicalData
     try {
-      let parsed;
-      // Try to parse content directly if it's a JSON string
-      try {
-        parsed = JSON.parse(content);
-      } catch (e) {
-        // If direct parsing fails, try to extract JSON from a larger string (e.g., wrapped in markdown)
-        const jsonMatch = content.match(/\{[\s\S]*\}/);
-        if (jsonMatch && jsonMatch[0]) {
-          parsed = JSON.parse(jsonMatch[0]);
-        } else {
-          // If no JSON object is found, throw an error to fall back to mock.
-          throw new Error("No valid JSON object found in AI response.");
-        }
+      // Locate the JSON, whether bare or wrapped in markdown
+      const parsed = parseJsonResponse(content);
+      if (!parsed) {
+        // If no JSON object is found, throw an error to fall back to mock.
+        throw new Error("No valid JSON object found in AI response.");
       }
       
       // Ensure all required fields exist, using defaults from your original code
@@ -259,8 +426,8 @@ If the image quality is too low or the content is uninterpretable, indicate this
         recommended_fixes: parsed.recommended_fixes || [],
         technical_score: technicalScore, // Use technicalScore extracted from technicalData
         visual_score: parsed.visual_score || 65,
-        total_issues: parsed.total_issues === undefined ? (technicalData.data?.analysis?.issues?.length || 0) : parsed.total_issues, // Prefer AI's count, else from technicalData
-        priority_fixes: parsed.priority_fixes || [], // Simpler default as per original
+        total_issues: parsed.total_issues === undefined ? (analysis?.issues?.length || 0) : parsed.total_issues, // Prefer AI's count, else from technicalData
+        priority_fixes: normalizePriorityFixes(parsed.priority_fixes),
         detailed_feedback: parsed.detailed_feedback || 'AI analysis completed successfully.' // Original default
       };
     } catch (error) {
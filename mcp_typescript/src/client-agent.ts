@@ -16,6 +16,17 @@ import { spawn, ChildProcess } from 'child_process';
 import { join, resolve, extname } from 'path';
 import { readFile, writeFile, mkdir } from 'fs/promises';
 import { existsSync } from 'fs';
+import { createHash } from 'crypto';
+import { connect } from 'net';
+import { mapWithConcurrency } from './concurrency.js';
+import type { DOMCaptureService } from './dom-capture.js';
+import type { CSSExtractorService } from './css-extractor.js';
+import type { HeuristicsEngineService } from './heuristics-engine.js';
+import type { ScreenshotService } from './screenshot.js';
+import type { AIAnalyzer } from './analyzer.js';
+
+// HTML files analyzed at once; they share one browser per service
+const MAX_CONCURRENT_ANALYSES = 3;
 
 interface AnalysisConfig {
   watchDirectory: string;
@@ -23,6 +34,7 @@ interface AnalysisConfig {
   outputDirectory: string;
   autoFix: boolean;
   analysisDelay: number;
+  fullPage: boolean; // Send a height-capped full-page screenshot instead of the viewport
 }
 
 interface FileChangeEvent {
@@ -33,6 +45,14 @@ interface FileChangeEvent {
   changeType: 'add' | 'change' | 'unlink';
 }
 
+interface AnalysisServices {
+  domCapture: DOMCaptureService;
+  cssExtractor: CSSExtractorService;
+  heuristicsEngine: HeuristicsEngineService;
+  screenshotService: ScreenshotService;
+  aiAnalyzer: AIAnalyzer;
+}
+
 interface AnalysisResult {
   success: boolean;
   score?: number;
@@ -44,10 +64,12 @@ interface AnalysisResult {
 
 class PixelPolishAIAgent {
   private config: AnalysisConfig;
-  private mcpProcess: ChildProcess | null = null;
   private isAnalyzing = false;
   private analysisQueue: FileChangeEvent[] = [];
   private localServer: ChildProcess | null = null;
+  private services: AnalysisServices | null = null;
+  private analysisTimer: NodeJS.Timeout | null = null;
+  private fileHashes = new Map<string, string>(); // Content hash of the last analyzed version
 
   constructor(config: Partial<AnalysisConfig> = {}) {
     this.config = {
@@ -56,6 +78,7 @@ class PixelPolishAIAgent {
       outputDirectory: resolve('./analysis-results'),
       autoFix: false,
       analysisDelay: 1000,
+      fullPage: false,
       ...config
     };
   }
@@ -84,8 +107,8 @@ class PixelPolishAIAgent {
     process.on('SIGINT', async () => {
       console.error('\n🛑 Shutting down AI agent...');
       await watcher.close();
+      await this.closeServices();
       await this.stopLocalServer();
-      await this.stopMCPServer();
       process.exit(0);
     });
   }
@@ -109,11 +132,26 @@ class PixelPolishAIAgent {
 
     console.error(`📝 File ${changeType}: ${fileName}`);
 
+    if (changeType === 'unlink') {
+      this.fileHashes.delete(filePath);
+    }
+
     // Add to analysis queue
     this.analysisQueue.push(event);
 
-    // Debounce analysis
-    setTimeout(() => {
+    this.scheduleAnalysis();
+  }
+
+  /**
+   * Debounce analysis: a burst of changes restarts the timer and is handled as one batch
+   */
+  private scheduleAnalysis(): void {
+    if (this.analysisTimer) {
+      clearTimeout(this.analysisTimer);
+    }
+
+    this.analysisTimer = setTimeout(() => {
+      this.analysisTimer = null;
       if (!this.isAnalyzing) {
         this.processAnalysisQueue();
       }
@@ -131,8 +169,14 @@ class PixelPolishAIAgent {
     this.analysisQueue = [];
 
     try {
+      // Keep only the latest event per file, so repeated saves are analyzed once
+      const latestEvents = new Map<string, FileChangeEvent>();
+      for (const event of events) {
+        latestEvents.set(event.filePath, event);
+      }
+
       // Group by HTML files (main pages to analyze)
-      const htmlFiles = events.filter(e => e.fileType === '.html' && e.changeType !== 'unlink');
+      const htmlFiles = [...latestEvents.values()].filter(e => e.fileType === '.html' && e.changeType !== 'unlink');
       
       if (htmlFiles.length === 0) {
         console.error('📄 No HTML files to analyze');
@@ -142,28 +186,44 @@ class PixelPolishAIAgent {
       // Start local server if needed
       await this.ensureLocalServer();
 
-      // Analyze each HTML file
-      for (const event of htmlFiles) {
-        await this.analyzeFile(event);
-      }
+      // Analyze the HTML files side by side; analyzeFile reports its own failures
+      await mapWithConcurrency(htmlFiles, MAX_CONCURRENT_ANALYSES, (event) => this.analyzeFile(event));
 
     } catch (error) {
       console.error('❌ Analysis queue processing failed:', error);
     } finally {
       this.isAnalyzing = false;
+
+      // Pick up changes that arrived while this batch was running
+      if (this.analysisQueue.length > 0 && !this.analysisTimer) {
+        this.scheduleAnalysis();
+      }
     }
   }
 
   private async analyzeFile(event: FileChangeEvent): Promise<void> {
-    console.error(`🔍 Starting analysis of: ${event.fileName}`);
-
     try {
+      // Skip files whose content is identical to the last analyzed version
+      const content = await readFile(event.filePath);
+      const contentHash = createHash('sha256').update(content).digest('hex');
+
+      if (this.fileHashes.get(event.filePath) === contentHash) {
+        console.error(`⏭️  Skipping ${event.fileName}: content unchanged since last analysis`);
+        return;
+      }
+
+      console.error(`🔍 Starting analysis of: ${event.fileName}`);
+
       // Build local URL
       const localUrl = `http://localhost:${this.config.localServerPort}/${event.fileName}`;
 
       // Call MCP server for analysis
       const result = await this.callMCPAnalysis(localUrl, event.fileName);
 
+      if (result.success) {
+        this.fileHashes.set(event.filePath, contentHash);
+      }
+
       // Process results
       await this.handleAnalysisResult(event, result);
 
@@ -183,39 +243,40 @@ class PixelPolishAIAgent {
     console.log(`🔍 Starting analysis of: ${url}`);
 
     try {
-      // Import analysis services directly
-      const { DOMCaptureService } = await import('./dom-capture.js');
-      const { CSSExtractorService } = await import('./css-extractor.js');
-      const { HeuristicsEngineService } = await import('./heuristics-engine.js');
-      const { ScreenshotService } = await import('./screenshot.js');
-      const { AIAnalyzer } = await import('./analyzer.js');
+      const { domCapture, cssExtractor, heuristicsEngine, screenshotService, aiAnalyzer } = await this.getServices();
 
-      // Initialize services
-      const domCapture = new DOMCaptureService();
-      const cssExtractor = new CSSExtractorService();
-      const heuristicsEngine = new HeuristicsEngineService();
-      const screenshotService = new ScreenshotService('./screenshots');
-      const aiAnalyzer = new AIAnalyzer(process.env.ANTHROPIC_API_KEY ? 'anthropic' : 'openai');
+      // Step 1: Start the screenshot in the background (separate Playwright browser)
+      const screenshotPromise = screenshotService.initialize()
+        .then(() => screenshotService.takeScreenshot(url, filename, {
+          resizeForAnalysis: true,
+          fullPage: this.config.fullPage
+        }));
 
-      // Step 1: Capture DOM structure
-      const domData = await domCapture.capture(url);
+      const technicalPromise = (async () => {
+        // Step 2: Capture DOM structure
+        const domData = await domCapture.capture(url);
 
-      // Step 2: Extract CSS patterns
-      const cssData = await cssExtractor.extract(domData.elements);
+        // Step 3: Extract CSS patterns
+        const cssData = await cssExtractor.extract(domData.elements);
 
-      // Step 3: Run heuristics analysis
-      const technicalAnalysis = await heuristicsEngine.analyze(domData, cssData);
+        // Step 4: Run heuristics analysis
+        const technicalAnalysis = await heuristicsEngine.analyze(domData, cssData);
 
-      // Step 4: Take screenshot
-      await screenshotService.initialize();
-      const screenshotResult = await screenshotService.takeScreenshot(url, filename);
+        return { domData, cssData, technicalAnalysis };
+      })();
+
+      const [{ domData, cssData, technicalAnalysis }, screenshotResult] = await Promise.all([
+        technicalPromise,
+        screenshotPromise
+      ]);
 
       let visualAnalysis = null;
       if (screenshotResult.success) {
         // Step 5: AI visual analysis
         visualAnalysis = await aiAnalyzer.analyzeScreenshot(
           screenshotResult.screenshotBase64,
-          { success: true, data: { dom: domData, css: cssData, analysis: technicalAnalysis } }
+          { success: true, data: { dom: domData, css: cssData, analysis: technicalAnalysis } },
+          screenshotResult.mimeType
         );
       }
 
@@ -224,9 +285,6 @@ class PixelPolishAIAgent {
         ? Math.round((technicalAnalysis.scorePercentage * 0.6) + (visualAnalysis.visual_score * 0.4))
         : technicalAnalysis.scorePercentage;
 
-      // Clean up
-      await screenshotService.close();
-
       return {
         success: true,
         score: combinedScore,
@@ -250,14 +308,40 @@ class PixelPolishAIAgent {
     }
   }
 
-  private async ensureMCPServer(): Promise<void> {
-    // No longer needed - we call services directly
-    return;
+  /**
+   * Lazily create the analysis services once and keep them (and the
+   * Playwright browser) alive across analyses instead of per file change
+   */
+  private async getServices(): Promise<AnalysisServices> {
+    if (this.services) return this.services;
+
+    // Import analysis services directly
+    const { DOMCaptureService } = await import('./dom-capture.js');
+    const { CSSExtractorService } = await import('./css-extractor.js');
+    const { HeuristicsEngineService } = await import('./heuristics-engine.js');
+    const { ScreenshotService } = await import('./screenshot.js');
+    const { AIAnalyzer } = await import('./analyzer.js');
+
+    // A concurrent caller may have finished the imports first
+    this.services ??= {
+      domCapture: new DOMCaptureService(),
+      cssExtractor: new CSSExtractorService(),
+      heuristicsEngine: new HeuristicsEngineService(),
+      screenshotService: new ScreenshotService('./screenshots'),
+      aiAnalyzer: new AIAnalyzer(process.env.ANTHROPIC_API_KEY ? 'anthropic' : 'openai')
+    };
+
+    return this.services;
   }
 
-  private async stopMCPServer(): Promise<void> {
-    // No longer needed - we call services directly
-    return;
+  private async closeServices(): Promise<void> {
+    if (!this.services) return;
+
+    await Promise.all([
+      this.services.screenshotService.close().catch(console.error),
+      this.services.domCapture.close().catch(console.error)
+    ]);
+    this.services = null;
   }
 
   /**
@@ -269,16 +353,19 @@ class PixelPolishAIAgent {
     console.error(`   Issues: ${result.issues?.length || 0}`);
     console.error(`   Fixes: ${result.fixes?.length || 0}`);
 
-    // Save detailed results
-    await this.saveAnalysisReport(event, result);
-
     // Show summary
     this.displayAnalysisSummary(event, result);
 
-    // Auto-apply fixes if enabled
-    if (this.config.autoFix && result.fixes && result.fixes.length > 0) {
-      await this.applyAutomaticFixes(event, result.fixes);
-    }
+    // Auto-apply fixes if enabled (only critical fixes that carry CSS)
+    const criticalCssFixes = this.config.autoFix && result.fixes
+      ? result.fixes.filter(fix => fix.css && fix.priority === 'critical')
+      : [];
+
+    // The report and the fixed source are separate files, so write both at once
+    await Promise.all([
+      this.saveAnalysisReport(event, result),
+      criticalCssFixes.length > 0 ? this.applyAutomaticFixes(event, criticalCssFixes) : Promise.resolve()
+    ]);
   }
 
   private async saveAnalysisReport(event: FileChangeEvent, result: AnalysisResult): Promise<void> {
@@ -355,24 +442,20 @@ class PixelPolishAIAgent {
     return recommendations;
   }
 
-  private async applyAutomaticFixes(event: FileChangeEvent, fixes: any[]): Promise<void> {
-    console.error(`🛠️  Applying ${fixes.length} automatic fixes to ${event.fileName}...`);
+  private async applyAutomaticFixes(event: FileChangeEvent, cssFixes: any[]): Promise<void> {
+    console.error(`🛠️  Applying ${cssFixes.length} automatic fixes to ${event.fileName}...`);
 
     try {
       const filePath = event.filePath;
       const content = await readFile(filePath, 'utf8');
-      let modifiedContent = content;
 
-      // Apply CSS fixes
-      const cssFixes = fixes.filter(fix => fix.css && fix.priority === 'critical');
-      
-      for (const fix of cssFixes) {
-        // Simple CSS injection (could be more sophisticated)
-        if (modifiedContent.includes('</head>')) {
-          const styleTag = `\n<style>\n/* Auto-fix: ${fix.description} */\n${fix.css}\n</style>\n`;
-          modifiedContent = modifiedContent.replace('</head>', `${styleTag}</head>`);
-        }
-      }
+      // Apply CSS fixes: build all style tags, then inject them in one pass
+      const styleTags = cssFixes
+        .map(fix => `\n<style>\n/* Auto-fix: ${fix.description} */\n${fix.css}\n</style>\n`)
+        .join('');
+      const modifiedContent = content.includes('</head>')
+        ? content.replace('</head>', () => `${styleTags}</head>`)
+        : content;
 
       if (modifiedContent !== content) {
         // Backup original
@@ -402,8 +485,31 @@ class PixelPolishAIAgent {
       stdio: 'inherit'
     });
 
-    // Wait for server to start
-    await new Promise(resolve => setTimeout(resolve, 1000));
+    // Wait until the server accepts connections rather than a fixed delay
+    await this.waitForPort(this.config.localServerPort);
+  }
+
+  /**
+   * Poll a local port until it accepts connections or the timeout passes
+   */
+  private async waitForPort(port: number, timeoutMs = 10000): Promise<void> {
+    const deadline = Date.now() + timeoutMs;
+
+    while (Date.now() < deadline) {
+      const isOpen = await new Promise<boolean>((resolve) => {
+        const socket = connect(port, 'localhost');
+        socket.once('connect', () => {
+          socket.destroy();
+          resolve(true);
+        });
+        socket.once('error', () => resolve(false));
+      });
+
+      if (isOpen) return;
+      await new Promise(resolve => setTimeout(resolve, 100));
+    }
+
+    console.warn(`⚠️ Local server did not open port ${port} within ${timeoutMs}ms`);
   }
 
   private async stopLocalServer(): Promise<void> {
@@ -465,6 +571,9 @@ if (import.meta.url === `file://${process.argv[1]}`) {
       case '--delay':
         config.analysisDelay = parseInt(args[++i]);
         break;
+      case '--full-page':
+        config.fullPage = true;
+        break;
       case '--help':
         console.error(`
 PixelPolish AI Agent - Complete File Watching & Analysis System
@@ -477,6 +586,7 @@ Options:
   --port <number>       Local server port (default: 8080)
   --auto-fix            Enable automatic fix application
   --delay <ms>          Analysis delay after file changes (default: 1000)
+  --full-page           Analyze the whole page (capped at 8000px) instead of the viewport
   --help                Show this help message
 
 Features:
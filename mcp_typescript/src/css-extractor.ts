@@ -12,6 +12,7 @@ import type {
   ResponsivenessAnalysis,
   DOMElement 
 } from './types.js';
+import { debug } from './logger.js';
 
 export class CSSExtractorService {
   private layoutProperties = new Set([
@@ -27,7 +28,7 @@ export class CSSExtractorService {
    * Extract comprehensive CSS analysis from DOM elements
    */
   async extract(elements: DOMElement[]): Promise<CSSData> {
-    console.error('🎨 Analyzing CSS patterns and styles...');
+    debug('🎨 Analyzing CSS patterns and styles...');
 
     const cssAnalysis: CSSData = {
       layoutStyles: this.extractLayoutStyles(elements),
@@ -38,7 +39,7 @@ export class CSSExtractorService {
       responsiveness: this.analyzeResponsiveness(elements)
     };
 
-    console.error('✅ CSS analysis complete');
+    debug('✅ CSS analysis complete');
     return cssAnalysis;
   }
 
@@ -4,6 +4,9 @@
 
 import puppeteer, { Browser, Page } from 'puppeteer';
 import * as cheerio from 'cheerio';
+import { Semaphore, concurrencyFromEnv } from './concurrency.js';
+import { debug } from './logger.js';
+import { STRUCTURE_ONLY_BLOCKED_TYPES, isAnalyticsRequest } from './request-filter.js';
 import type { DOMData, DOMElement, DOMStructure } from './types.js';
 
 export class DOMCaptureService {
@@ -17,42 +20,109 @@ export class DOMCaptureService {
     'color', 'background-color', 'border', 'border-radius', 'box-shadow'
   ]);
 
+  // Shared browser, recycled after a number of pages or once it gets old
+  private browser: Browser | null = null;
+  private browserLaunch: Promise<Browser> | null = null;
+  private browserCreatedAt = 0;
+  private pagesProcessed = 0;
+  private openPages = new Map<Browser, number>();
+  private maxPagesPerBrowser: number;
+  private maxBrowserAgeMs: number;
+  private closed = false;
+
+  // Captures in progress by URL, so identical concurrent requests share one
+  private inflightCaptures = new Map<string, Promise<DOMData>>();
+
+  // Caps how many pages are open at once, since each one holds a renderer
+  private captureSlots: Semaphore;
+
+  constructor(
+    maxPagesPerBrowser = 50,
+    maxBrowserAgeMs = 10 * 60 * 1000,
+    maxConcurrentCaptures = concurrencyFromEnv('PIXELPOLISH_CAPTURE_CONCURRENCY', 5)
+  ) {
+    this.maxPagesPerBrowser = maxPagesPerBrowser;
+    this.maxBrowserAgeMs = maxBrowserAgeMs;
+    this.captureSlots = new Semaphore(maxConcurrentCaptures);
+  }
+
   /**
-   * Capture DOM structure and element data from a URL
+   * Capture DOM structure and element data from a URL. blockResources skips
+   * images and fonts too, for callers that only need the document structure.
    */
-  async capture(url: string): Promise<DOMData> {
-    let browser: Browser | null = null;
+  async capture(url: string, options: { blockResources?: boolean } = {}): Promise<DOMData> {
+    const { blockResources = false } = options;
+    const key = blockResources ? `${url}\0structure` : url;
+
+    const inflight = this.inflightCaptures.get(key);
+    if (inflight) {
+      debug(() => `🔗 Joining in-progress DOM capture of: ${url}`);
+      return inflight;
+    }
+
+    const capture = this.captureSlots.run(() => this.captureFresh(url, blockResources)).finally(() => {
+      this.inflightCaptures.delete(key);
+    });
+    this.inflightCaptures.set(key, capture);
+    return capture;
+  }
+
+  private async captureFresh(url: string, blockResources: boolean): Promise<DOMData> {
+    const browser = await this.acquireBrowser();
     let page: Page | null = null;
 
     try {
-      // Create a fresh browser instance for each capture
-      browser = await puppeteer.launch({
-        headless: true,
-        args: ['--no-sandbox', '--disable-setuid-sandbox']
-      });
-      
       page = await browser.newPage();
 
       // Disable cache to ensure fresh content
       await page.setCacheEnabled(false);
 
+      // Skip analytics downloads; media, images and fonts feed the measured
+      // layout, so they are only skipped when just the structure is wanted
+      await page.setRequestInterception(true);
+      page.on('request', (request) => {
+        const blocked = (blockResources && STRUCTURE_ONLY_BLOCKED_TYPES.has(request.resourceType()))
+          || isAnalyticsRequest(request.url());
+        (blocked ? request.abort() : request.continue()).catch(() => {});
+      });
+
       // Set viewport for consistent rendering
       await page.setViewport({ width: 1920, height: 1080 });
 
-      console.error(`🔍 Capturing DOM structure from: ${url}`);
+      debug(() => `🔍 Capturing DOM structure from: ${url}`);
 
-      // Navigate to the page
-      await page.goto(url, { 
-        waitUntil: 'networkidle2',
+      // Navigate to the page; 'load' also means readyState is 'complete'
+      const response = await page.goto(url, { 
+        waitUntil: 'load',
         timeout: 30000 
       });
 
-      // Wait for any dynamic content to load
-      await page.waitForFunction(() => document.readyState === 'complete');
+      // Don't walk the DOM of an error page
+      if (response && !response.ok()) {
+        throw new Error(`HTTP ${response.status()} loading ${url}`);
+      }
+
+      // Wait for any dynamic content to load, but no more than two seconds
+      // for pages whose network never goes quiet
+      await page.waitForNetworkIdle({ idleTime: 500, concurrency: 2, timeout: 2000 }).catch(() => {});
 
-      // Extract DOM structure and element data
-      const domData = await page.evaluate(() => {
+      // Extract element data and the HTML for structural parsing in one round-trip
+      const { html, ...domData } = await page.evaluate(() => {
         const elements: any[] = [];
+
+        // Same result as textContent.trim().substring(0, 100), but stops
+        // reading text nodes once 100 characters are in hand; textContent on
+        // <body> would otherwise copy the whole page's text for every ancestor
+        const previewText = (element: Element): string | null => {
+          const textNodes = document.createTreeWalker(element, NodeFilter.SHOW_TEXT);
+          let text = '';
+          let textNode: Node | null;
+          while (text.trim().length < 100 && (textNode = textNodes.nextNode())) {
+            text += textNode.nodeValue;
+          }
+          return text.trim().substring(0, 100) || null;
+        };
+
         const walker = document.createTreeWalker(
           document.body,
           NodeFilter.SHOW_ELEMENT,
@@ -70,7 +140,7 @@ export class DOMCaptureService {
               tagName: node.tagName.toLowerCase(),
               id: node.id || null,
               className: node.className || null,
-              textContent: node.textContent?.trim().substring(0, 100) || null,
+              textContent: previewText(node),
               boundingRect: {
                 x: rect.x,
                 y: rect.y,
@@ -115,7 +185,14 @@ export class DOMCaptureService {
           }
         }
 
+        // HTML minus raw-text subtrees the structure extraction never reads, so
+        // less markup is serialized and parsed (svg and template stay, since
+        // links and heading titles can live inside them)
+        const root = document.documentElement.cloneNode(true) as Element;
+        root.querySelectorAll('script, style, noscript').forEach(node => node.remove());
+
         return {
+          html: root.outerHTML,
           url: window.location.href,
           title: document.title,
           viewport: {
@@ -127,14 +204,12 @@ export class DOMCaptureService {
         };
       });
 
-      // Get the raw HTML for additional parsing
-      const html = await page.content();
       const $ = cheerio.load(html);
 
       // Extract additional structural information
       const structure = this.extractStructure($);
 
-      console.error(`✅ DOM captured: ${domData.totalElements} elements`);
+      debug(() => `✅ DOM captured: ${domData.totalElements} elements`);
 
       return {
         ...domData,
@@ -143,14 +218,96 @@ export class DOMCaptureService {
       };
 
     } finally {
-      // Always close the page and browser
+      // Always close the page and hand the browser back
       if (page) {
         await page.close().catch(console.error);
       }
-      if (browser) {
-        await browser.close().catch(console.error);
+      await this.releaseBrowser(browser);
+    }
+  }
+
+  /**
+   * Close every browser this service has launched
+   */
+  async close(): Promise<void> {
+    // Refuse new launches, and wait out one already under way so its browser
+    // is closed below instead of leaking
+    this.closed = true;
+    await this.browserLaunch?.catch(() => null);
+
+    const browsers = [...this.openPages.keys()];
+    this.browser = null;
+    this.openPages.clear();
+    await Promise.all(browsers.map(browser => browser.close().catch(console.error)));
+  }
+
+  /**
+   * Get the shared browser, launching it on first use or after a recycle
+   */
+  private async acquireBrowser(): Promise<Browser> {
+    if (this.closed) {
+      throw new Error('DOM capture service is closed');
+    }
+
+    let browser = this.browser;
+    if (!browser || !browser.isConnected()) {
+      if (!this.browserLaunch) {
+        this.browserLaunch = this.launchBrowser().finally(() => {
+          this.browserLaunch = null;
+        });
+      }
+      browser = await this.browserLaunch;
+    }
+
+    this.openPages.set(browser, (this.openPages.get(browser) || 0) + 1);
+    return browser;
+  }
+
+  /**
+   * Return a browser after a capture, retiring it once it has served its quota
+   */
+  private async releaseBrowser(browser: Browser): Promise<void> {
+    const remaining = Math.max(0, (this.openPages.get(browser) || 0) - 1);
+    this.openPages.set(browser, remaining);
+
+    if (browser === this.browser) {
+      this.pagesProcessed++;
+      const expired = Date.now() - this.browserCreatedAt > this.maxBrowserAgeMs;
+      if (this.pagesProcessed >= this.maxPagesPerBrowser || expired) {
+        console.error(`♻️ Recycling DOM capture browser after ${this.pagesProcessed} pages`);
+        this.browser = null;
       }
     }
+
+    // Retired browsers close once their last capture finishes
+    if (browser !== this.browser && remaining === 0) {
+      this.openPages.delete(browser);
+      await browser.close().catch(console.error);
+    }
+  }
+
+  private async launchBrowser(): Promise<Browser> {
+    console.error('🚀 Launching DOM capture browser...');
+    const browser = await puppeteer.launch({
+      headless: true,
+      args: [
+        '--no-sandbox',
+        '--disable-setuid-sandbox',
+        '--disable-dev-shm-usage',
+        '--disable-gpu'
+      ]
+    });
+
+    browser.on('disconnected', () => {
+      if (this.browser === browser) this.browser = null;
+      this.openPages.delete(browser);
+    });
+
+    this.browser = browser;
+    this.browserCreatedAt = Date.now();
+    this.pagesProcessed = 0;
+    this.openPages.set(browser, 0);
+    return browser;
   }
 
   /**
@@ -10,6 +10,7 @@ import type {
   Recommendation, 
   RuleResult 
 } from './types.js';
+import { debug } from './logger.js';
 
 export class HeuristicsEngineService {
   private rules: BaseRule[];
@@ -29,7 +30,7 @@ export class HeuristicsEngineService {
    * Run comprehensive heuristics analysis
    */
   async analyze(domData: DOMData, cssData: CSSData): Promise<HeuristicsAnalysis> {
-    console.error('📊 Running heuristics analysis...');
+    debug('📊 Running heuristics analysis...');
 
     const analysis: HeuristicsAnalysis = {
       score: 0,
@@ -54,7 +55,7 @@ export class HeuristicsEngineService {
     // Run each heuristic rule
     for (const rule of this.rules) {
       try {
-        console.error(`  Running ${rule.name}...`);
+        debug(() => `  Running ${rule.name}...`);
         const result = await rule.evaluate(domData, cssData);
         
         analysis.ruleResults.push({
@@ -89,7 +90,7 @@ export class HeuristicsEngineService {
     // Generate summary
     analysis.summary = this.generateSummary(analysis);
 
-    console.error(`✅ Analysis complete: ${analysis.scorePercentage}% (${analysis.issues.length} issues)`);
+    debug(() => `✅ Analysis complete: ${analysis.scorePercentage}% (${analysis.issues.length} issues)`);
     
     return analysis;
   }
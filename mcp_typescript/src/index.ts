@@ -16,19 +16,44 @@ import {
 import { DOMCaptureService } from './dom-capture.js';
 import { CSSExtractorService } from './css-extractor.js';
 import { HeuristicsEngineService } from './heuristics-engine.js';
-import { ScreenshotService } from './screenshot.js';
+import { ScreenshotService, isScreenshotFormat } from './screenshot.js';
 import { AIAnalyzer } from './analyzer.js';
+import { mapWithConcurrency } from './concurrency.js';
+import { TtlLruCache } from './lru-cache.js';
 import type { ComprehensiveAnalysis } from './types.js';
 import { dirname, join } from 'path';
 import { fileURLToPath } from 'url';
 import { createServer } from 'http';
-import { readFileSync, existsSync } from 'fs';
+import { existsSync } from 'fs';
+import { open } from 'fs/promises';
+import type { FileHandle } from 'fs/promises';
 import { extname } from 'path';
 import { exec } from 'child_process';
 import { promisify } from 'util';
 
 const execAsync = promisify(exec);
 
+// Content-Type by file extension for the static portal server
+const CONTENT_TYPES: { [key: string]: string } = {
+  '.html': 'text/html',
+  '.js': 'application/javascript',
+  '.css': 'text/css',
+  '.json': 'application/json',
+  '.png': 'image/png',
+  '.jpg': 'image/jpeg',
+  '.jpeg': 'image/jpeg',
+  '.gif': 'image/gif',
+  '.svg': 'image/svg+xml',
+  '.ico': 'image/x-icon',
+  '.woff': 'font/woff',
+  '.woff2': 'font/woff2',
+  '.ttf': 'font/ttf',
+  '.eot': 'application/vnd.ms-fontobject'
+};
+
+// Static files larger than this are read from disk on every request
+const MAX_CACHED_STATIC_FILE_BYTES = 1024 * 1024;
+
 // Shared state for API requests
 interface ApiRequest {
   timestamp: number;
@@ -45,6 +70,8 @@ class PixelPolishMCPServer {
   private aiAnalyzer: AIAnalyzer;
   private httpServer: any = null;
   private apiRequests: ApiRequest[] = []; // Queue for incoming API requests
+  private apiRequestWaiters: Array<() => void> = []; // Wake-ups for pending wait calls
+  private staticFileCache = new TtlLruCache<Buffer>(128, 10 * 60 * 1000); // Keyed by path + ETag
 
   constructor() {
     this.server = new Server(
@@ -76,34 +103,65 @@ class PixelPolishMCPServer {
   }
 
   private getContentType(filePath: string): string {
-    const ext = extname(filePath).toLowerCase();
-    const contentTypes: { [key: string]: string } = {
-      '.html': 'text/html',
-      '.js': 'application/javascript',
-      '.css': 'text/css',
-      '.json': 'application/json',
-      '.png': 'image/png',
-      '.jpg': 'image/jpeg',
-      '.jpeg': 'image/jpeg',
-      '.gif': 'image/gif',
-      '.svg': 'image/svg+xml',
-      '.ico': 'image/x-icon',
-      '.woff': 'font/woff',
-      '.woff2': 'font/woff2',
-      '.ttf': 'font/ttf',
-      '.eot': 'application/vnd.ms-fontobject'
-    };
-    return contentTypes[ext] || 'application/octet-stream';
+    return CONTENT_TYPES[extname(filePath).toLowerCase()] || 'application/octet-stream';
+  }
+
+  /**
+   * Serve a static file with an ETag so unchanged assets revalidate with 304.
+   * Resolves false, without responding, when no regular file is at the path.
+   */
+  private async sendStaticFile(req: any, res: any, filePath: string, contentType: string): Promise<boolean> {
+    let file: FileHandle;
+    try {
+      file = await open(filePath, 'r');
+    } catch {
+      return false;
+    }
+
+    try {
+      // One open + fstat covers the existence check, the ETag and the read
+      const stats = await file.stat();
+      if (!stats.isFile()) return false;
+
+      const etag = `W/"${stats.size.toString(16)}-${Math.floor(stats.mtimeMs).toString(16)}"`;
+      const cacheHeaders = { 'ETag': etag, 'Cache-Control': 'no-cache' };
+
+      if (req.headers['if-none-match'] === etag) {
+        res.writeHead(304, cacheHeaders);
+        res.end();
+        return true;
+      }
+
+      // The ETag changes with size or mtime, so a cached body is never stale
+      const cacheKey = `${filePath}:${etag}`;
+      let body = this.staticFileCache.get(cacheKey);
+      if (!body) {
+        body = await file.readFile();
+        if (body.length <= MAX_CACHED_STATIC_FILE_BYTES) {
+          this.staticFileCache.set(cacheKey, body);
+        }
+      }
+
+      // Validators go out only with a body that was actually read, so a
+      // failed read never leaves a cacheable 500 behind
+      res.writeHead(200, { ...cacheHeaders, 'Content-Type': contentType });
+      res.end(body);
+      return true;
+    } finally {
+      await file.close();
+    }
   }
 
   private parsePostData(req: any): Promise<any> {
     return new Promise((resolve, reject) => {
-      let body = '';
-      req.on('data', (chunk: any) => {
-        body += chunk.toString();
+      const chunks: Buffer[] = [];
+      req.on('data', (chunk: Buffer) => {
+        chunks.push(chunk);
       });
       req.on('end', () => {
         try {
+          // Decode once so multi-byte characters split across chunks stay intact
+          const body = Buffer.concat(chunks).toString('utf8');
           const data = body ? JSON.parse(body) : {};
           resolve(data);
         } catch (error) {
@@ -127,6 +185,12 @@ class PixelPolishMCPServer {
               properties: {
                 url: { type: 'string', description: 'URL to analyze' },
                 include_screenshot: { type: 'boolean', default: true },
+                screenshot_format: { type: 'string', enum: ['jpeg', 'png', 'webp'], default: 'jpeg', description: 'Image format sent to the AI model' },
+                resize_for_analysis: { type: 'boolean', default: true, description: 'Downscale the image sent to the AI model to a 1568px long edge' },
+                max_dimension: { type: 'number', minimum: 256, default: 1568, description: 'Long-edge limit in pixels when resize_for_analysis is on' },
+                use_cache: { type: 'boolean', default: true, description: 'Reuse a recent AI assessment of an identical screenshot' },
+                full_page: { type: 'boolean', default: false, description: 'Send the whole scrollable page instead of just the viewport' },
+                max_height: { type: 'number', default: 8000, description: 'Cut full-page captures off at this height in pixels' },
                 ai_provider: { type: 'string', enum: ['openai', 'anthropic'], default: 'openai' },
               },
               required: ['url'],
@@ -140,10 +204,39 @@ class PixelPolishMCPServer {
               properties: {
                 url: { type: 'string', description: 'URL to screenshot' },
                 filename: { type: 'string', default: 'screenshot' },
+                format: { type: 'string', enum: ['jpeg', 'png', 'webp'], default: 'jpeg' },
+                viewport_width: { type: 'number', default: 1920 },
+                viewport_height: { type: 'number', default: 1080 },
+                full_page: { type: 'boolean', default: false, description: 'Capture the whole scrollable page' },
+                max_height: { type: 'number', default: 8000, description: 'Cut full-page captures off at this height in pixels' },
+                clip: {
+                  type: 'object',
+                  description: 'Capture only this rectangle (page coordinates)',
+                  properties: {
+                    x: { type: 'number' },
+                    y: { type: 'number' },
+                    width: { type: 'number' },
+                    height: { type: 'number' },
+                  },
+                  required: ['x', 'y', 'width', 'height'],
+                },
               },
               required: ['url'],
             },
           },
+          {
+            name: 'capture_screenshots_batch',
+            description: 'Take screenshots of several URLs concurrently with one shared browser',
+            inputSchema: {
+              type: 'object',
+              properties: {
+                urls: { type: 'array', items: { type: 'string' }, description: 'URLs to screenshot' },
+                filename: { type: 'string', default: 'screenshot', description: 'Filename prefix (numbered per URL)' },
+                max_concurrency: { type: 'number', minimum: 1, default: 4, description: 'Maximum screenshots in flight at once (capped by the 4-page browser pool)' },
+              },
+              required: ['urls'],
+            },
+          },
           {
             name: 'analyze_dom_structure',
             description: 'Extract and analyze DOM structure',
@@ -151,6 +244,7 @@ class PixelPolishMCPServer {
               type: 'object',
               properties: {
                 url: { type: 'string', description: 'URL to analyze' },
+                block_resources: { type: 'boolean', default: false, description: 'Skip image and font downloads for a faster, structure-only capture' },
               },
               required: ['url'],
             },
@@ -214,6 +308,8 @@ class PixelPolishMCPServer {
             return await this.handleAnalyzeUrl(args);
           case 'capture_screenshot':
             return await this.handleCaptureScreenshot(args);
+          case 'capture_screenshots_batch':
+            return await this.handleCaptureScreenshotsBatch(args);
           case 'analyze_dom_structure':
             return await this.handleAnalyzeDomStructure(args);
           case 'run_heuristics_analysis':
@@ -235,32 +331,52 @@ class PixelPolishMCPServer {
   }
 
   private async handleAnalyzeUrl(args: any) {
-    const { url, include_screenshot = true, ai_provider = 'openai' } = args;
+    const { url, include_screenshot = true, ai_provider = 'openai', screenshot_format = 'jpeg', resize_for_analysis = true, max_dimension, use_cache = true, full_page = false, max_height } = args;
 
     if (!url) {
       throw new McpError(ErrorCode.InvalidParams, 'URL is required');
     }
 
+    if (!isScreenshotFormat(screenshot_format)) {
+      throw new McpError(ErrorCode.InvalidParams, `Unsupported screenshot_format: ${screenshot_format}`);
+    }
+
     console.error(`🔍 Starting analysis of: ${url}`);
 
-    const domData = await this.domCapture.capture(url);
-    const cssData = await this.cssExtractor.extract(domData.elements);
-    const technicalAnalysis = await this.heuristicsEngine.analyze(domData, cssData);
+    // The screenshot uses its own Playwright browser, so capture it while the
+    // Puppeteer DOM capture and heuristics run
+    const screenshotPromise = include_screenshot
+      ? this.screenshotService.initialize().then(() => this.screenshotService.takeScreenshot(url, 'analysis', {
+        format: screenshot_format,
+        resizeForAnalysis: resize_for_analysis,
+        maxDimension: max_dimension,
+        fullPage: full_page,
+        maxHeight: max_height
+      }))
+      : Promise.resolve(null);
+
+    const technicalPromise = (async () => {
+      const domData = await this.domCapture.capture(url);
+      const cssData = await this.cssExtractor.extract(domData.elements);
+      const technicalAnalysis = await this.heuristicsEngine.analyze(domData, cssData);
+      return { domData, cssData, technicalAnalysis };
+    })();
+
+    const [{ domData, cssData, technicalAnalysis }, screenshotResult] = await Promise.all([
+      technicalPromise,
+      screenshotPromise
+    ]);
 
-    let screenshotResult = null;
     let visualAnalysis = null;
 
-    if (include_screenshot) {
-      await this.screenshotService.initialize();
-      screenshotResult = await this.screenshotService.takeScreenshot(url, 'analysis');
-
-      if (screenshotResult.success) {
-        this.aiAnalyzer = new AIAnalyzer(ai_provider as 'openai' | 'anthropic');
-        visualAnalysis = await this.aiAnalyzer.analyzeScreenshot(
-          screenshotResult.screenshotBase64,
-          { success: true, data: { dom: domData, css: cssData, analysis: technicalAnalysis } }
-        );
-      }
+    if (screenshotResult?.success) {
+      this.aiAnalyzer = new AIAnalyzer(ai_provider as 'openai' | 'anthropic');
+      visualAnalysis = await this.aiAnalyzer.analyzeScreenshot(
+        screenshotResult.screenshotBase64,
+        { success: true, data: { dom: domData, css: cssData, analysis: technicalAnalysis } },
+        screenshotResult.mimeType,
+        use_cache
+      );
     }
 
     const combinedScore = visualAnalysis
@@ -313,14 +429,34 @@ ${technicalAnalysis.recommendations.slice(0, 3).map((rec, i) =>
   }
 
   private async handleCaptureScreenshot(args: any) {
-    const { url, filename = 'screenshot' } = args;
+    const {
+      url,
+      filename = 'screenshot',
+      format = 'jpeg',
+      viewport_width = 1920,
+      viewport_height = 1080,
+      full_page = false,
+      max_height,
+      clip
+    } = args;
 
     if (!url) {
       throw new McpError(ErrorCode.InvalidParams, 'URL is required');
     }
 
+    if (!isScreenshotFormat(format)) {
+      throw new McpError(ErrorCode.InvalidParams, `Unsupported format: ${format}`);
+    }
+
     await this.screenshotService.initialize();
-    const result = await this.screenshotService.takeScreenshot(url, filename);
+    const result = await this.screenshotService.takeScreenshot(url, filename, {
+      encodeBase64: false,
+      format,
+      fullPage: full_page,
+      maxHeight: max_height,
+      clip,
+      viewport: { width: viewport_width, height: viewport_height }
+    });
 
     const resultText = result.success 
       ? `Screenshot captured: ${result.filename}\nPath: ${result.screenshotPath}`
@@ -332,14 +468,51 @@ ${technicalAnalysis.recommendations.slice(0, 3).map((rec, i) =>
     };
   }
 
+  private async handleCaptureScreenshotsBatch(args: any) {
+    const { urls, filename = 'screenshot', max_concurrency = 4 } = args;
+
+    if (!Array.isArray(urls) || urls.length === 0 || !urls.every(url => typeof url === 'string' && url)) {
+      throw new McpError(ErrorCode.InvalidParams, 'urls must be a non-empty array of URL strings');
+    }
+
+    const requestedConcurrency = Math.floor(Number(max_concurrency));
+    if (!(requestedConcurrency >= 1)) {
+      throw new McpError(ErrorCode.InvalidParams, 'max_concurrency must be a positive integer');
+    }
+
+    // More workers than pooled pages would only queue inside the service
+    const concurrency = Math.min(requestedConcurrency, this.screenshotService.pageLimit);
+
+    await this.screenshotService.initialize();
+    const results = await mapWithConcurrency(urls, concurrency, (url: string, i) =>
+      this.screenshotService.takeScreenshot(url, `${filename}_${i + 1}`, { encodeBase64: false })
+    );
+
+    const capturedCount = results.filter(result => result.success).length;
+    const resultText = `# Batch Screenshots
+
+**Captured:** ${capturedCount}/${urls.length}
+
+${results.map((result, i) => result.success
+  ? `${i + 1}. ✅ ${urls[i]}\n   Path: ${result.screenshotPath}`
+  : `${i + 1}. ❌ ${urls[i]}\n   Error: ${result.error}`
+).join('\n')}
+`;
+
+    return {
+      content: [{ type: "text", text: resultText }],
+      isError: capturedCount === 0
+    };
+  }
+
   private async handleAnalyzeDomStructure(args: any) {
-    const { url } = args;
+    const { url, block_resources = false } = args;
 
     if (!url) {
       throw new McpError(ErrorCode.InvalidParams, 'URL is required');
     }
 
-    const domData = await this.domCapture.capture(url);
+    const domData = await this.domCapture.capture(url, { blockResources: block_resources });
 
     const resultText = `# DOM Structure Analysis
 
@@ -453,7 +626,10 @@ ${analysis.issues.slice(0, 5).map((issue, i) =>
             };
             
             this.apiRequests.push(apiRequest);
-            console.error(`📨 API request received: ${JSON.stringify(postData)}`);
+            this.apiRequestWaiters.splice(0).forEach((wake) => wake());
+            // Log a summary only; submissions can carry full page data
+            const fields = postData && typeof postData === 'object' ? Object.keys(postData) : [];
+            console.error(`📨 API request received (fields: ${fields.join(', ') || 'none'})`);
             
             // Respond to the API call
             res.setHeader('Content-Type', 'application/json');
@@ -494,19 +670,15 @@ ${analysis.issues.slice(0, 5).map((issue, i) =>
         const fullPath = join(dist_path, filePath);
 
         try {
-          if (existsSync(fullPath)) {
-            const content = readFileSync(fullPath);
-            const contentType = this.getContentType(fullPath);
-            
-            res.setHeader('Content-Type', contentType);
-            res.writeHead(200);
-            res.end(content);
-          } else {
-            // For SPA routing, serve index.html for routes that don't exist
-            const indexContent = readFileSync(indexPath);
-            res.setHeader('Content-Type', 'text/html');
-            res.writeHead(200);
-            res.end(indexContent);
+          let served = await this.sendStaticFile(req, res, fullPath, this.getContentType(fullPath));
+
+          // For SPA routing, serve index.html for routes that don't exist
+          if (!served) {
+            served = await this.sendStaticFile(req, res, indexPath, 'text/html');
+          }
+
+          if (!served) {
+            throw new Error(`Missing ${indexPath}`);
           }
         } catch (fileError) {
           console.error('File read error:', fileError);
@@ -634,7 +806,7 @@ SPA routing is supported - all routes will serve index.html.
     const startTime = Date.now();
     const timeoutMs = duration_seconds * 1000;
     
-    // Poll for API requests during the wait period
+    // Check for API requests whenever one arrives during the wait period
     while (Date.now() - startTime < timeoutMs) {
       // Check if any API requests have come in
       if (this.apiRequests.length > 0) {
@@ -650,8 +822,19 @@ SPA routing is supported - all routes will serve index.html.
         };
       }
       
-      // Wait 100ms before checking again
-      await new Promise<void>(resolve => setTimeout(resolve, 100));
+      // Sleep until /api/submit receives a request or the wait period ends
+      await new Promise<void>((resolve) => {
+        const wake = () => {
+          clearTimeout(timer);
+          resolve();
+        };
+        const timer = setTimeout(() => {
+          this.apiRequestWaiters = this.apiRequestWaiters.filter((waiter) => waiter !== wake);
+          resolve();
+        }, timeoutMs - (Date.now() - startTime));
+
+        this.apiRequestWaiters.push(wake);
+      });
     }
 
     // No API requests received within timeout
@@ -667,6 +850,14 @@ SPA routing is supported - all routes will serve index.html.
     const transport = new StdioServerTransport();
     await this.server.connect(transport);
     console.error('PixelPolish MCP Server running on stdio');
+
+    process.on('SIGINT', async () => {
+      await Promise.all([
+        this.screenshotService.close().catch(console.error),
+        this.domCapture.close().catch(console.error)
+      ]);
+      process.exit(0);
+    });
   }
 }
 
@@ -0,0 +1,34 @@
+/**
+ * Pull the JSON object out of an AI model's reply
+ */
+
+// JSON object from a fenced ```json block, falling back to the outermost braces
+const JSON_BLOCK_PATTERN = /```(?:json)?\s*(\{[\s\S]*?\})\s*```|(\{[\s\S]*\})/;
+
+/**
+ * Parse the JSON object in a model reply, whether bare or wrapped in markdown.
+ * The fenced match is lazy and can stop early at a "}```" inside a string
+ * value, so the outermost braces and then the raw reply are tried before
+ * giving up. Returns null when nothing parses.
+ */
+export function parseJsonResponse(content: string): any | null {
+  const match = JSON_BLOCK_PATTERN.exec(content);
+  const start = content.indexOf('{');
+  const end = content.lastIndexOf('}');
+
+  const candidates = [
+    match?.[1] || match?.[2],
+    start !== -1 && end > start ? content.slice(start, end + 1) : undefined,
+    content
+  ];
+
+  for (const candidate of candidates) {
+    if (!candidate) continue;
+    try {
+      return JSON.parse(candidate);
+    } catch {
+      // Try the next, wider candidate
+    }
+  }
+  return null;
+}
@@ -0,0 +1,82 @@
+/**
+ * Shared AI SDK clients, connection pooling and retry policy for the analyzers
+ */
+
+import { Agent } from 'https';
+import { Semaphore, concurrencyFromEnv } from './concurrency.js';
+import { debug } from './logger.js';
+
+// SDK clients are built once per provider and API key, so their HTTP
+// connections stay alive between analyses
+const sdkClients = new Map<string, Promise<any>>();
+
+// One keep-alive agent shared by the OpenAI and Anthropic clients, so TLS
+// connections are reused across analyses and concurrent uploads are bounded
+const providerAgent = new Agent({ keepAlive: true, keepAliveMsecs: 30000, maxSockets: 16 });
+
+// Requests are retried by withRetries with jittered backoff instead of inside
+// the SDKs, and a stalled request fails after this long
+export const PROVIDER_TIMEOUT_MS = 60 * 1000;
+const MAX_REQUEST_ATTEMPTS = 4;
+const RETRYABLE_STATUSES = new Set([429, 500, 502, 503, 504]);
+
+// Provider requests in flight at once, so a burst of analyses queues here
+// instead of tripping the provider's rate limit
+const providerSlots = new Semaphore(concurrencyFromEnv('PIXELPOLISH_AI_CONCURRENCY', 8));
+
+/**
+ * Get the cached client for a key, creating it on first use
+ */
+export function getCachedClient<T>(key: string, create: () => Promise<T>): Promise<T> {
+  let client = sdkClients.get(key);
+
+  if (!client) {
+    client = create();
+    sdkClients.set(key, client);
+    // Let a failed import or construction be retried on the next call
+    client.catch(() => sdkClients.delete(key));
+  }
+
+  return client;
+}
+
+/**
+ * Shared OpenAI client for an API key
+ */
+export function getOpenAIClient(apiKey: string) {
+  return getCachedClient(`openai:${apiKey}`, async () => {
+    const OpenAI = (await import('openai')).default;
+    return new OpenAI({ apiKey, httpAgent: providerAgent, maxRetries: 0, timeout: PROVIDER_TIMEOUT_MS });
+  });
+}
+
+/**
+ * Shared Anthropic client for an API key
+ */
+export function getAnthropicClient(apiKey: string) {
+  return getCachedClient(`anthropic:${apiKey}`, async () => {
+    const Anthropic = (await import('@anthropic-ai/sdk')).default;
+    return new Anthropic({ apiKey, httpAgent: providerAgent, maxRetries: 0, timeout: PROVIDER_TIMEOUT_MS });
+  });
+}
+
+/**
+ * Run a provider call within the concurrency cap, retrying rate limits and
+ * server errors with exponential backoff plus jitter
+ */
+export async function withRetries<T>(call: () => Promise<T>): Promise<T> {
+  for (let attempt = 1; ; attempt++) {
+    try {
+      // Each attempt takes a slot; the backoff sleep below holds none
+      return await providerSlots.run(call);
+    } catch (error: any) {
+      if (attempt >= MAX_REQUEST_ATTEMPTS || !RETRYABLE_STATUSES.has(error?.status)) {
+        throw error;
+      }
+
+      const delayMs = 250 * 2 ** (attempt - 1) + Math.random() * 250;
+      debug(() => `🔁 AI request failed with HTTP ${error.status}, retrying in ${Math.round(delayMs)}ms`);
+      await new Promise(resolve => setTimeout(resolve, delayMs));
+    }
+  }
+}
@@ -0,0 +1,20 @@
+/**
+ * Debug logging for per-request detail, enabled with PIXELPOLISH_DEBUG=1
+ */
+
+/**
+ * Whether debug logging is switched on
+ */
+export function isDebugEnabled(): boolean {
+  const flag = process.env.PIXELPOLISH_DEBUG?.toLowerCase();
+  return flag === '1' || flag === 'true';
+}
+
+/**
+ * Log to stderr when debug logging is on. Pass a function to skip building
+ * the message entirely when it is off.
+ */
+export function debug(message: string | (() => string)): void {
+  if (!isDebugEnabled()) return;
+  console.error(typeof message === 'function' ? message() : message);
+}
@@ -0,0 +1,46 @@
+/**
+ * Bounded in-memory cache with LRU eviction and per-entry expiry
+ */
+
+export class TtlLruCache<V> {
+  private entries = new Map<string, { value: V; expiresAt: number }>();
+  private maxSize: number;
+  private ttlMs: number;
+
+  constructor(maxSize: number, ttlMs: number) {
+    this.maxSize = maxSize;
+    this.ttlMs = ttlMs;
+  }
+
+  /**
+   * Get a live entry and mark it as most recently used
+   */
+  get(key: string): V | undefined {
+    const entry = this.entries.get(key);
+    if (!entry) return undefined;
+
+    this.entries.delete(key);
+    if (entry.expiresAt <= Date.now()) return undefined;
+
+    // Map keeps insertion order, so re-inserting moves the key to the end
+    this.entries.set(key, entry);
+    return entry.value;
+  }
+
+  /**
+   * Store an entry, evicting the least recently used ones past the size cap
+   */
+  set(key: string, value: V): void {
+    this.entries.delete(key);
+    this.entries.set(key, { value, expiresAt: Date.now() + this.ttlMs });
+
+    while (this.entries.size > this.maxSize) {
+      const oldestKey = this.entries.keys().next().value;
+      this.entries.delete(oldestKey);
+    }
+  }
+
+  clear(): void {
+    this.entries.clear();
+  }
+}
@@ -0,0 +1,33 @@
+/**
+ * Request filtering shared by the browser-backed capture services
+ */
+
+// Trackers and beacons that never change how a page looks
+const ANALYTICS_HOSTS = [
+  'google-analytics.com',
+  'googletagmanager.com',
+  'doubleclick.net',
+  'segment.io',
+  'segment.com',
+  'hotjar.com',
+  'connect.facebook.net'
+];
+
+// Resource types skipped when only the document structure is wanted; element
+// sizes (e.g. <video> without explicit dimensions) and text metrics may then
+// differ from the rendered page
+export const STRUCTURE_ONLY_BLOCKED_TYPES = new Set(['media', 'image', 'font']);
+
+/**
+ * Whether a request goes to a known analytics host
+ */
+export function isAnalyticsRequest(url: string): boolean {
+  let hostname: string;
+  try {
+    hostname = new URL(url).hostname;
+  } catch {
+    return false;
+  }
+
+  return ANALYTICS_HOSTS.some(host => hostname === host || hostname.endsWith(`.${host}`));
+}
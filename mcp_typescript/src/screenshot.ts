@@ -2,44 +2,147 @@
  * Screenshot service using Playwright for high-quality visual capture
  */
 
-import { chromium, Browser, Page } from 'playwright';
-import { writeFile, mkdir } from 'fs/promises';
+import { chromium, Browser, BrowserContext, Page } from 'playwright';
+import { writeFile, mkdir, readdir, unlink } from 'fs/promises';
 import { join } from 'path';
-import type { ScreenshotResult } from './types.js';
+import { debug } from './logger.js';
+import { isAnalyticsRequest } from './request-filter.js';
+import type { ImageMimeType, ScreenshotFormat, ScreenshotOptions, ScreenshotResult } from './types.js';
+
+const DEFAULT_VIEWPORT = { width: 1920, height: 1080 };
+
+// Tallest full-page capture; longer pages are cut off here rather than laid
+// out and encoded in one huge image (Chromium fails beyond 16384px anyway)
+const MAX_FULL_PAGE_HEIGHT = 8000;
+
+// Longest we wait for the network to go quiet after the load event; pages with
+// polling or long-lived connections would otherwise hold every capture to 30s
+const NETWORK_IDLE_TIMEOUT_MS = 2000;
+
+// Long edge for images sent to vision models; larger images only cost more tokens
+// (1568px is the largest size Claude accepts without resizing internally)
+const ANALYSIS_MAX_DIMENSION = 1568;
+
+// Minimum quality for a downscaled JPEG/WebP, since it is a second lossy encode
+const ANALYSIS_MIN_QUALITY = 85;
+
+const FORMAT_DETAILS: Readonly<Record<ScreenshotFormat, { extension: string; mimeType: ImageMimeType }>> = Object.freeze({
+  jpeg: { extension: 'jpg', mimeType: 'image/jpeg' },
+  png: { extension: 'png', mimeType: 'image/png' },
+  webp: { extension: 'webp', mimeType: 'image/webp' }
+});
+
+/**
+ * Check a tool argument against the supported screenshot formats
+ */
+export function isScreenshotFormat(value: unknown): value is ScreenshotFormat {
+  return typeof value === 'string' && Object.hasOwn(FORMAT_DETAILS, value);
+}
 
 export class ScreenshotService {
   private browser: Browser | null = null;
+  private context: BrowserContext | null = null;
   private screenshotsDir: string;
   private isInitialized = false;
+  private initializing: Promise<void> | null = null;
+
+  // Pool of reusable pages in the shared context
+  private maxPages: number;
+  private openPages = 0;
+  private idlePages: Page[] = [];
+  private pageWaiters: Array<() => void> = [];
+
+  // Cookies accumulated in the shared context are dropped every N pages
+  private pagesPerCookieReset = 50;
+  private pagesSinceCookieReset = 0;
 
-  constructor(screenshotsDir: string) {
+  // Newest screenshots kept on disk per filename
+  private maxScreenshotsPerName: number;
+  private lastTimestamp = 0;
+
+  constructor(screenshotsDir: string, maxPages = 4, maxScreenshotsPerName = 20) {
     this.screenshotsDir = screenshotsDir;
+    this.maxPages = maxPages;
+    this.maxScreenshotsPerName = maxScreenshotsPerName;
   }
 
   /**
-   * Initialize Playwright browser
+   * Initialize Playwright browser, relaunching it if the old one disconnected.
+   * Concurrent callers share a single launch.
    */
   async initialize(): Promise<void> {
-    if (this.isInitialized) return;
+    if (this.isInitialized && this.browser?.isConnected()) return;
+
+    if (!this.initializing) {
+      this.initializing = this.launch().finally(() => {
+        this.initializing = null;
+      });
+    }
+    return this.initializing;
+  }
 
+  private async launch(): Promise<void> {
     try {
       console.error('🎭 Initializing Playwright browser...');
       
       // Ensure screenshots directory exists
       await mkdir(this.screenshotsDir, { recursive: true });
 
-      // Launch browser with optimized settings
-      this.browser = await chromium.launch({
-        headless: true,
-        args: [
-          '--no-sandbox',
-          '--disable-setuid-sandbox',
-          '--disable-dev-shm-usage',
-          '--disable-web-security',
-          '--disable-features=VizDisplayCompositor'
-        ]
+      // Attach to a shared Chromium when one is exposed over CDP,
+      // otherwise launch our own with optimized settings
+      const cdpEndpoint = process.env.PIXELPOLISH_CDP_ENDPOINT;
+      this.browser = cdpEndpoint
+        ? await chromium.connectOverCDP(cdpEndpoint)
+        : await chromium.launch({
+          headless: true,
+          args: [
+            '--no-sandbox',
+            '--disable-setuid-sandbox',
+            '--disable-dev-shm-usage',
+            '--disable-gpu',
+            '--disable-web-security',
+            '--disable-features=VizDisplayCompositor'
+          ]
+        });
+
+      // Forget a browser that crashed or was closed remotely, so the next
+      // screenshot relaunches instead of failing on a dead connection
+      const browser = this.browser;
+      browser.on('disconnected', () => {
+        if (this.browser === browser) {
+          console.error('⚠️ Playwright browser disconnected');
+          this.resetBrowserState();
+        }
       });
 
+      // Share one context across screenshots, with the viewport set up front
+      this.context = await this.browser.newContext({
+        viewport: DEFAULT_VIEWPORT
+      });
+
+      // Drop analytics beacons and disable cache to ensure fresh content
+      await this.context.route('**/*', (route) => {
+        if (isAnalyticsRequest(route.request().url())) {
+          route.abort();
+          return;
+        }
+
+        route.continue({
+          headers: {
+            ...route.request().headers(),
+            'Cache-Control': 'no-cache, no-store, must-revalidate',
+            'Pragma': 'no-cache',
+            'Expires': '0'
+          }
+        });
+      });
+
+      // Warm up one pooled page so the first screenshot skips renderer startup
+      const warmPage = await this.context.newPage();
+      await warmPage.goto('about:blank');
+      this.openPages++;
+      this.idlePages.push(warmPage);
+
       this.isInitialized = true;
       console.error('✅ Playwright browser initialized');
 
@@ -52,73 +155,102 @@ export class ScreenshotService {
   /**
    * Take a screenshot of the specified URL
    */
-  async takeScreenshot(url: string, filename: string): Promise<ScreenshotResult> {
-    if (!this.browser) {
-      await this.initialize();
-    }
+  async takeScreenshot(url: string, filename: string, options: ScreenshotOptions = {}): Promise<ScreenshotResult> {
+    const {
+      encodeBase64 = true,
+      resizeForAnalysis = false,
+      maxDimension = ANALYSIS_MAX_DIMENSION,
+      fullPage = false,
+      maxHeight = MAX_FULL_PAGE_HEIGHT,
+      format = 'jpeg',
+      quality = 75
+    } = options;
+    const { extension, mimeType } = FORMAT_DETAILS[format];
+
+    await this.initialize();
 
     let page: Page | null = null;
 
     try {
-      console.error(`📸 Taking screenshot of: ${url}`);
+      debug(() => `📸 Taking screenshot of: ${url}`);
 
-      // Create new page with cache disabled
-      page = await this.browser!.newPage();
-      
-      // Disable cache to ensure fresh content
-      await page.route('**/*', (route) => {
-        route.continue({
-          headers: {
-            ...route.request().headers(),
-            'Cache-Control': 'no-cache, no-store, must-revalidate',
-            'Pragma': 'no-cache',
-            'Expires': '0'
-          }
-        });
-      });
-
-      // Set viewport for consistent screenshots
-      await page.setViewportSize({ width: 1920, height: 1080 });
+      // Borrow a page from the pool (cache headers preset) and size it
+      page = await this.acquirePage();
+      const viewport = options.viewport || DEFAULT_VIEWPORT;
+      const currentViewport = page.viewportSize();
+      if (currentViewport?.width !== viewport.width || currentViewport?.height !== viewport.height) {
+        await page.setViewportSize(viewport);
+      }
 
-      // Add cache-busting timestamp to URL
-      const timestamp = Date.now();
+      // Add cache-busting timestamp to URL (unique per capture, so concurrent
+      // screenshots with the same name never overwrite each other)
+      const timestamp = this.nextTimestamp();
       const cacheBustedUrl = url.includes('?') 
         ? `${url}&t=${timestamp}` 
         : `${url}?t=${timestamp}`;
 
       // Navigate to the page
-      await page.goto(cacheBustedUrl, { 
-        waitUntil: 'networkidle',
+      const response = await page.goto(cacheBustedUrl, { 
+        waitUntil: 'load',
         timeout: 30000 
       });
 
-      // Wait for any dynamic content to load
-      await page.waitForLoadState('domcontentloaded');
-      await page.waitForTimeout(1000); // Additional wait for any animations
+      // Don't spend the settle wait and capture on an error page
+      if (response && !response.ok()) {
+        throw new Error(`HTTP ${response.status()} loading ${url}`);
+      }
 
-      // Take screenshot
-      const screenshotBuffer = await page.screenshot({
-        fullPage: true,
-        type: 'png'
-      });
+      // Give late requests a bounded chance to finish, then let animations settle
+      await page.waitForLoadState('networkidle', { timeout: NETWORK_IDLE_TIMEOUT_MS }).catch(() => {});
+      await page.waitForTimeout(1000);
+
+      // Clip long full-page captures to the height cap
+      let clip = options.clip;
+      if (fullPage && !clip) {
+        const pageHeight = await page.evaluate(() => document.documentElement.scrollHeight);
+        if (pageHeight > maxHeight) {
+          debug(() => `✂️ Clipping ${pageHeight}px page to ${maxHeight}px`);
+          clip = { x: 0, y: 0, width: viewport.width, height: maxHeight };
+        }
+      }
+
+      // Take screenshot (viewport-sized unless a full page or clip is requested).
+      // Chromium cannot emit WebP, so capture lossless PNG and re-encode it.
+      const { imageBuffer, analysisBuffer } = await this.encodeCapture(
+        format === 'jpeg'
+          ? await page.screenshot({ fullPage, clip, type: 'jpeg', quality })
+          : await page.screenshot({ fullPage, clip, type: 'png' }),
+        format,
+        quality,
+        encodeBase64 && resizeForAnalysis ? maxDimension : null
+      );
 
       // Generate filename
-      const screenshotFilename = `${filename.replace(/[^a-zA-Z0-9]/g, '_')}_${timestamp}.png`;
+      const safeName = filename.replace(/[^a-zA-Z0-9]/g, '_');
+      const screenshotFilename = `${safeName}_${timestamp}.${extension}`;
       const screenshotPath = join(this.screenshotsDir, screenshotFilename);
 
-      // Save screenshot to file
-      await writeFile(screenshotPath, screenshotBuffer);
+      // Start saving to file; the write runs off-thread while we encode
+      const fileWritten = writeFile(screenshotPath, imageBuffer);
+
+      // Convert to base64 for embedding, skipped when the caller only needs the file
+      let screenshotBase64 = '';
+      if (encodeBase64) {
+        screenshotBase64 = (analysisBuffer || imageBuffer).toString('base64');
+      }
+      await fileWritten;
 
-      // Convert to base64 for embedding
-      const screenshotBase64 = screenshotBuffer.toString('base64');
+      // Trim older screenshots of the same name in the background
+      this.evictOldScreenshots(safeName).catch(console.error);
 
-      console.error(`✅ Screenshot saved: ${screenshotPath}`);
+      debug(() => `✅ Screenshot saved: ${screenshotPath} (${imageBuffer.length} bytes)`);
 
       return {
         success: true,
         filename: screenshotFilename,
         screenshotPath,
         screenshotBase64,
+        mimeType,
         timestamp
       };
 
@@ -130,18 +262,168 @@ export class ScreenshotService {
         filename: '',
         screenshotPath: '',
         screenshotBase64: '',
+        mimeType,
         timestamp: Date.now(),
         error: error instanceof Error ? error.message : 'Screenshot failed'
       };
 
     } finally {
-      // Always close the page
+      // Always hand the page back to the pool
       if (page) {
-        await page.close().catch(console.error);
+        await this.releasePage(page);
+      }
+    }
+  }
+
+  /**
+   * Encode the saved image and, when maxDimension is set, a downscaled
+   * analysis copy from the same capture in parallel on sharp's threads. For
+   * WebP this spares decoding the WebP again and a second lossy generation;
+   * the raw capture goes out of scope on return, before base64 encoding.
+   * analysisBuffer is null when there was nothing to shrink.
+   */
+  private async encodeCapture(
+    captured: Buffer,
+    format: ScreenshotFormat,
+    quality: number,
+    maxDimension: number | null
+  ): Promise<{ imageBuffer: Buffer; analysisBuffer: Buffer | null }> {
+    const [imageBuffer, analysisBuffer] = await Promise.all([
+      format === 'webp' ? this.encodeWebp(captured, quality) : captured,
+      maxDimension ? this.downscale(captured, maxDimension, format, quality) : null
+    ]);
+
+    // downscale hands back its input when it does not resize
+    return { imageBuffer, analysisBuffer: analysisBuffer === captured ? null : analysisBuffer };
+  }
+
+  /**
+   * Re-encode a PNG capture as WebP
+   */
+  private async encodeWebp(pngBuffer: Buffer, quality: number): Promise<Buffer> {
+    const { default: sharp } = await import('sharp');
+    return sharp(pngBuffer).webp({ quality }).toBuffer();
+  }
+
+  /**
+   * Shrink an image so its long edge fits maxDimension, keeping the original
+   * when it is already small enough or cannot be resized
+   */
+  private async downscale(buffer: Buffer, maxDimension: number, format: ScreenshotFormat, quality: number): Promise<Buffer> {
+    try {
+      const { default: sharp } = await import('sharp');
+      const image = sharp(buffer);
+      const { width = 0, height = 0 } = await image.metadata();
+      if (Math.max(width, height) <= maxDimension) return buffer;
+
+      return await image
+        .resize({ width: maxDimension, height: maxDimension, fit: 'inside' })
+        .toFormat(format, format === 'png' ? {} : { quality: Math.max(quality, ANALYSIS_MIN_QUALITY) })
+        .toBuffer();
+    } catch (error) {
+      console.warn('⚠️ Screenshot downscale failed, sending full size:', error);
+      return buffer;
+    }
+  }
+
+  /**
+   * Millisecond timestamp that strictly increases across calls
+   */
+  private nextTimestamp(): number {
+    this.lastTimestamp = Math.max(Date.now(), this.lastTimestamp + 1);
+    return this.lastTimestamp;
+  }
+
+  /**
+   * Delete all but the newest screenshots saved under the given name
+   */
+  private async evictOldScreenshots(safeName: string): Promise<void> {
+    const pattern = new RegExp(`^${safeName}_(\\d+)\\.\\w+$`);
+    const screenshots = (await readdir(this.screenshotsDir))
+      .map((file) => ({ file, timestamp: Number(pattern.exec(file)?.[1]) }))
+      .filter(({ timestamp }) => !Number.isNaN(timestamp))
+      .sort((a, b) => b.timestamp - a.timestamp);
+
+    await Promise.all(
+      screenshots
+        .slice(this.maxScreenshotsPerName)
+        .map(({ file }) => unlink(join(this.screenshotsDir, file)).catch(() => {}))
+    );
+  }
+
+  /**
+   * Get an idle page from the pool, opening a new one while under the limit
+   */
+  private async acquirePage(): Promise<Page> {
+    while (true) {
+      const idlePage = this.idlePages.pop();
+      if (idlePage) return idlePage;
+
+      // The browser may have dropped while we were queued
+      if (!this.context) await this.initialize();
+
+      if (this.openPages < this.maxPages) {
+        this.openPages++;
+        try {
+          return await this.context!.newPage();
+        } catch (error) {
+          this.openPages--;
+          this.pageWaiters.shift()?.();
+          throw error;
+        }
       }
+
+      await new Promise<void>((resolve) => this.pageWaiters.push(resolve));
     }
   }
 
+  /**
+   * Reset a page and return it to the pool, dropping it if it is unusable
+   */
+  private async releasePage(page: Page): Promise<void> {
+    // A page from a browser that has since disconnected or been closed is not
+    // counted in the current pool; just make sure it is gone
+    if (page.context() !== this.context) {
+      await page.close().catch(() => {});
+      return;
+    }
+
+    try {
+      await page.goto('about:blank');
+      this.idlePages.push(page);
+
+      if (++this.pagesSinceCookieReset >= this.pagesPerCookieReset) {
+        this.pagesSinceCookieReset = 0;
+        await this.context?.clearCookies().catch(console.error);
+      }
+    } catch {
+      // The browser may have dropped (and the pool reset) during the goto
+      if (page.context() === this.context) this.openPages--;
+      await page.close().catch(() => {});
+    }
+
+    this.pageWaiters.shift()?.();
+  }
+
+  /**
+   * Drop all state tied to the current browser and wake queued page requests
+   */
+  private resetBrowserState(): void {
+    this.browser = null;
+    this.context = null;
+    this.isInitialized = false;
+    this.idlePages = [];
+    this.openPages = 0;
+    this.pageWaiters.splice(0).forEach((wake) => wake());
+  }
+
+  /**
+   * Most pages the pool keeps open, i.e. how many screenshots can run at once
+   */
+  get pageLimit(): number {
+    return this.maxPages;
+  }
+
   /**
    * Check if service is initialized
    */
@@ -155,9 +437,21 @@ export class ScreenshotService {
   async close(): Promise<void> {
     if (this.browser) {
       console.error('🛑 Closing Playwright browser...');
-      await this.browser.close();
+
+      // Detach first so the 'disconnected' handler treats this as intentional
+      const browser = this.browser;
+      const context = this.context;
       this.browser = null;
+      this.context = null;
       this.isInitialized = false;
+      this.idlePages = [];
+      this.openPages = 0;
+      this.pageWaiters.splice(0).forEach((wake) => wake());
+
+      if (context) {
+        await context.close().catch(console.error);
+      }
+      await browser.close();
       console.error('✅ Playwright browser closed');
     }
   }
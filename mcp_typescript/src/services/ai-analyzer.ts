@@ -1,4 +1,23 @@
-import { AnalysisData } from '../types';
+import { AnalysisData, ImageMimeType } from '../types';
+import { getAnthropicClient, getOpenAIClient, withRetries } from '../llm-clients.js';
+import { parseJsonResponse } from '../json-response.js';
+
+// Fixed CSS guidance appended to every enhanced prompt
+const ENHANCED_PROMPT_GUIDELINES = `**CSS Fix Guidelines:**
+- Use generic but effective selectors (body, h1, h2, p, button, .container, etc.)
+- Provide complete CSS rules, not fragments
+- Focus on: typography, spacing, colors, layout, responsiveness
+- Make fixes that work without knowing exact HTML structure
+- Prioritize high-impact visual improvements
+- Include CSS that improves accessibility
+
+**Example Good CSS Fixes:**
+- "body { font-family: 'Segoe UI', Arial, sans-serif; line-height: 1.6; margin: 0; }"
+- "h1, h2, h3 { margin-bottom: 0.5em; color: #2c3e50; font-weight: 600; }"
+- "button { padding: 12px 24px; border-radius: 6px; background: #3498db; color: white; border: none; cursor: pointer; transition: all 0.3s; }"
+- ".container { max-width: 1200px; margin: 0 auto; padding: 0 20px; }"
+
+Generate 3-8 priority fixes with working CSS code that can be immediately applied.`;
 
 interface AIAnalysis {
   visual_assessment: {
@@ -35,15 +54,15 @@ export class AIAnalyzer {
     this.provider = provider;
   }
 
-  async analyzeScreenshot(screenshotBase64: string, technicalData: AnalysisData): Promise<AIAnalysis> {
+  async analyzeScreenshot(screenshotBase64: string, technicalData: AnalysisData, mimeType: ImageMimeType = 'image/png'): Promise<AIAnalysis> {
     if (this.provider === 'openai') {
-      return this.analyzeWithOpenAI(screenshotBase64, technicalData);
+      return this.analyzeWithOpenAI(screenshotBase64, technicalData, mimeType);
     } else {
-      return this.analyzeWithAnthropic(screenshotBase64, technicalData);
+      return this.analyzeWithAnthropic(screenshotBase64, technicalData, mimeType);
     }
   }
 
-  private async analyzeWithOpenAI(screenshotBase64: string, technicalData: AnalysisData): Promise<AIAnalysis> {
+  private async analyzeWithOpenAI(screenshotBase64: string, technicalData: AnalysisData, mimeType: ImageMimeType): Promise<AIAnalysis> {
     const apiKey = process.env.OPENAI_API_KEY;
     
     if (!apiKey) {
@@ -51,13 +70,12 @@ export class AIAnalyzer {
       return this.generateMockAnalysis(technicalData);
     }
 
-    const { OpenAI } = await import('openai');
-    const openai = new OpenAI({ apiKey });
+    const openai = await getOpenAIClient(apiKey);
 
     const technicalScore = technicalData.data?.analysis?.scorePercentage || 0;
     const heuristicsScore = technicalData.data?.analysis || { total: 0, passed: 0, failed: 0, details: [] };
 
-    const response = await openai.chat.completions.create({
+    const response = await withRetries(() => openai.chat.completions.create({
       model: "gpt-4o",
       max_tokens: 2000,
       messages: [
@@ -71,20 +89,20 @@ export class AIAnalyzer {
             {
               type: "image_url",
               image_url: {
-                url: `data:image/png;base64,${screenshotBase64}`,
+                url: `data:${mimeType};base64,${screenshotBase64}`,
                 detail: "high"
               }
             }
           ]
         }
       ]
-    });
+    }));
 
     const content = response.choices[0]?.message?.content || '';
     return this.parseAIResponse(content, technicalScore);
   }
 
-  private async analyzeWithAnthropic(screenshotBase64: string, technicalData: AnalysisData): Promise<AIAnalysis> {
+  private async analyzeWithAnthropic(screenshotBase64: string, technicalData: AnalysisData, mimeType: ImageMimeType): Promise<AIAnalysis> {
     const apiKey = process.env.ANTHROPIC_API_KEY;
     
     if (!apiKey) {
@@ -92,13 +110,12 @@ export class AIAnalyzer {
       return this.generateMockAnalysis(technicalData);
     }
 
-    const Anthropic = (await import('@anthropic-ai/sdk')).default;
-    const client = new Anthropic({ apiKey });
+    const client = await getAnthropicClient(apiKey);
 
     const technicalScore = technicalData.data?.analysis?.scorePercentage || 0;
     const heuristicsScore = technicalData.data?.analysis || { total: 0, passed: 0, failed: 0, details: [] };
 
-    const response = await client.messages.create({
+    const response = await withRetries(() => client.messages.create({
       model: "claude-3-5-sonnet-20241022",
       max_tokens: 2000,
       messages: [
@@ -113,14 +130,14 @@ export class AIAnalyzer {
               type: "image",
               source: {
                 type: "base64",
-                media_type: "image/png",
+                media_type: mimeType,
                 data: screenshotBase64
               }
             }
           ]
         }
       ]
-    });
+    }));
 
     const content = response.content[0]?.type === 'text' ? response.content[0].text : '';
     return this.parseAIResponse(content, technicalScore);
@@ -165,28 +182,13 @@ Provide JSON response with specific, actionable fixes. Focus on the biggest visu
   "detailed_feedback": "Comprehensive analysis of the design"
 }
 
-**CSS Fix Guidelines:**
-- Use generic but effective selectors (body, h1, h2, p, button, .container, etc.)
-- Provide complete CSS rules, not fragments
-- Focus on: typography, spacing, colors, layout, responsiveness
-- Make fixes that work without knowing exact HTML structure
-- Prioritize high-impact visual improvements
-- Include CSS that improves accessibility
-
-**Example Good CSS Fixes:**
-- "body { font-family: 'Segoe UI', Arial, sans-serif; line-height: 1.6; margin: 0; }"
-- "h1, h2, h3 { margin-bottom: 0.5em; color: #2c3e50; font-weight: 600; }"
-- "button { padding: 12px 24px; border-radius: 6px; background: #3498db; color: white; border: none; cursor: pointer; transition: all 0.3s; }"
-- ".container { max-width: 1200px; margin: 0 auto; padding: 0 20px; }"
-
-Generate 3-8 priority fixes with working CSS code that can be immediately applied.`;
+${ENHANCED_PROMPT_GUIDELINES}`;
   }
 
   private parseAIResponse(content: string, technicalScore: number): AIAnalysis {
     try {
-      const jsonMatch = content.match(/\{[\s\S]*\}/);
-      if (jsonMatch) {
-        const parsed = JSON.parse(jsonMatch[0]);
+      const parsed = parseJsonResponse(content);
+      if (parsed) {
         
         // Ensure priority_fixes have the right format for auto-fix
         const enhancedFixes = (parsed.priority_fixes || []).map((fix: any) => ({
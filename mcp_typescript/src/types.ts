@@ -204,11 +204,37 @@ export interface RuleResult {
 
 // === Screenshot Types ===
 
+export type ImageMimeType = 'image/png' | 'image/jpeg' | 'image/webp' | 'image/gif';
+
+export type ScreenshotFormat = 'jpeg' | 'png' | 'webp';
+
+export interface ScreenshotOptions {
+  /** Also return the image as base64 (only needed when it is sent to an AI model) */
+  encodeBase64?: boolean;
+  /** Downscale the base64 copy to a 1568px long edge for AI models; the saved file keeps full size */
+  resizeForAnalysis?: boolean;
+  /** Long-edge limit used by resizeForAnalysis, in pixels (default: 1568) */
+  maxDimension?: number;
+  /** Capture the whole scrollable page instead of just the viewport */
+  fullPage?: boolean;
+  /** Height cap for full-page captures, in pixels (default: 8000) */
+  maxHeight?: number;
+  /** Capture only this rectangle of the page, e.g. a hero section */
+  clip?: { x: number; y: number; width: number; height: number };
+  /** Viewport size for this capture (default: 1920x1080) */
+  viewport?: { width: number; height: number };
+  /** Image format; WebP is re-encoded from a PNG capture with sharp */
+  format?: ScreenshotFormat;
+  /** JPEG/WebP quality (0-100) */
+  quality?: number;
+}
+
 export interface ScreenshotResult {
   success: boolean;
   filename: string;
   screenshotPath: string;
   screenshotBase64: string;
+  mimeType: ImageMimeType;
   timestamp: number;
   error?: string;
 }